@@ -0,0 +1,18 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled fallback conversion for sync_core.py.
+Build in place with: python setup.py build_ext --inplace
+"""
+
+def convert_column(list values):
+    """
+    Stringify every non-null value of a non-native column, in place.
+    """
+    cdef Py_ssize_t i
+    cdef Py_ssize_t n = len(values)
+    cdef object val
+    for i in range(n):
+        val = values[i]
+        if val is not None:
+            values[i] = str(val)
+    return values
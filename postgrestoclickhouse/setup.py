@@ -0,0 +1,10 @@
+# Builds the optional compiled column converter used by sync_core.py:
+#   python setup.py build_ext --inplace
+# sync_core.py falls back to pure Python when the extension is not built.
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="postgrestoclickhouse-convert",
+    ext_modules=cythonize("_convert.pyx"),
+)
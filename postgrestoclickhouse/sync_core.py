@@ -0,0 +1,537 @@
+# sync_core.py
+# Shared PostgreSQL -> ClickHouse sync logic; entrypoints import from here.
+import psycopg
+from psycopg import pq
+from psycopg.types.datetime import (
+    DateBinaryLoader, TimestampBinaryLoader, TimestamptzBinaryLoader
+)
+from clickhouse_driver import Client as CHClient
+import datetime
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+import struct
+import time
+
+# Import credentials from db_config
+from db_config import PG_CONFIG, CLICKHOUSE_CONFIG
+
+# ------------------------------
+# Helper function to convert columns
+# ------------------------------
+TEXT_OID = psycopg.postgres.types['text'].oid
+
+# PostgreSQL types psycopg loads as bool/int/float/str/date/datetime, which
+# clickhouse_driver accepts as-is. Any other type (numeric, uuid, json, arrays,
+# ...) is sent as a string.
+PG_NATIVE_TYPE_OIDS = frozenset(
+    psycopg.postgres.types[name].oid
+    for name in (
+        'bool', 'int2', 'int4', 'int8', 'oid', 'float4', 'float8',
+        'text', 'varchar', 'bpchar', 'name', 'date', 'timestamp', 'timestamptz',
+    )
+)
+
+def get_convert_columns(row_columns, row_types):
+    """
+    Return the names of columns whose PostgreSQL type needs converting.
+    """
+    return {
+        col for col, type_oid in zip(row_columns, row_types)
+        if type_oid not in PG_NATIVE_TYPE_OIDS
+    }
+
+try:
+    # Compiled with Cython (see setup.py); converts the list in place
+    from _convert import convert_column as convert_column_for_ch
+except ImportError:
+    def convert_column_for_ch(values):
+        """
+        Converts one non-native column of PostgreSQL values to ClickHouse strings.
+        """
+        return [v if v is None else str(v) for v in values]
+
+# ------------------------------
+# Incremental client aggregates
+# ------------------------------
+# Per-client LAD / first case date over completed studies, kept in an
+# AggregatingMergeTree so background merges collapse each client_fk to one row.
+# Studies become COMPLETED some time after they are created, and Studies has
+# no completion timestamp to use as a watermark. Each refresh therefore
+# re-aggregates a trailing window of recent studies. Re-inserting max/min
+# values is idempotent, so overlapping windows are safe. A full rebuild at
+# least every CLIENT_AGG_REBUILD_HOURS catches studies completed outside the
+# window and drops stale aggregates. rebuilt_at records the last full rebuild;
+# window refreshes write the epoch so they never advance it.
+CLIENT_AGG_TABLE = "transform.client_agg"
+CLIENT_AGG_RESCAN_DAYS = 7
+CLIENT_AGG_REBUILD_HOURS = 24
+
+# NULL client_fks are filtered in the subquery and the key wrapped in
+# assumeNotNull, so the AggregatingMergeTree sort key is never Nullable
+CLIENT_AGG_SELECT = """
+SELECT
+    assumeNotNull(client_fk) AS client_fk,
+    CAST(toDateTime(MAX(created_at)) AS SimpleAggregateFunction(max, DateTime)) AS lad,
+    CAST(toDateTime(MIN(created_at)) AS SimpleAggregateFunction(min, DateTime)) AS fcd,
+    CAST({rebuilt_at} AS SimpleAggregateFunction(max, DateTime)) AS rebuilt_at
+FROM (
+    SELECT client_fk, created_at
+    FROM transform.Studies
+    WHERE status = 'COMPLETED'
+      AND client_fk IS NOT NULL{window}
+)
+GROUP BY client_fk
+"""
+
+CLIENT_AGG_FULL_SELECT = CLIENT_AGG_SELECT.format(rebuilt_at="now()", window="")
+
+CLIENT_AGG_WINDOW_SELECT = CLIENT_AGG_SELECT.format(
+    rebuilt_at="toDateTime(0)",
+    window=f"\n      AND created_at >= now() - INTERVAL {CLIENT_AGG_RESCAN_DAYS} DAY",
+)
+
+def rebuild_client_aggregates(ch_client):
+    """
+    Recompute transform.client_agg from all of Studies and swap it in.
+    """
+    staging_table = f"{CLIENT_AGG_TABLE}__new"
+    ch_client.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    ch_client.execute(f"CREATE TABLE {staging_table} AS {CLIENT_AGG_TABLE}")
+    try:
+        ch_client.execute(f"INSERT INTO {staging_table} {CLIENT_AGG_FULL_SELECT}")
+        ch_client.execute(f"EXCHANGE TABLES {CLIENT_AGG_TABLE} AND {staging_table}")
+    finally:
+        ch_client.execute(f"DROP TABLE IF EXISTS {staging_table}")
+
+def refresh_client_aggregates(ch_client):
+    """
+    Bring transform.client_agg up to date: a full rebuild when the last one is
+    older than CLIENT_AGG_REBUILD_HOURS, otherwise a trailing-window refresh.
+    """
+    ch_client.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CLIENT_AGG_TABLE}
+        ENGINE = AggregatingMergeTree
+        ORDER BY client_fk
+        AS {CLIENT_AGG_FULL_SELECT}
+    """)
+    
+    [(rebuild_due,)] = ch_client.execute(f"""
+        SELECT max(rebuilt_at) < now() - INTERVAL {CLIENT_AGG_REBUILD_HOURS} HOUR
+        FROM {CLIENT_AGG_TABLE}
+    """)
+    if rebuild_due:
+        print("[INFO] Rebuilding client aggregates from all studies...")
+        rebuild_client_aggregates(ch_client)
+    else:
+        ch_client.execute(f"INSERT INTO {CLIENT_AGG_TABLE} {CLIENT_AGG_WINDOW_SELECT}")
+
+# ------------------------------
+# Optimized Account Status Logic
+# ------------------------------
+# Computed entirely inside ClickHouse: per-client LAD / first case date joined
+# with Clients, with the business rules expressed as a single multiIf. The
+# chunk's client_fks are sent as the external table chunk_clients, and both
+# sides are filtered by it so the join's right-hand table stays chunk-sized
+# instead of loading all of Clients. {client_stats} is the stored aggregates,
+# or Studies itself when they could not be refreshed.
+ACCOUNT_STATUS_TEMPLATE = """
+SELECT
+    s.client_fk,
+    multiIf(
+        toDate(s.lad) >= %(active_since)s, 'Active',
+        toDate(s.lad) >= %(inactive_since)s, 'In-Active',
+        dateDiff('day',
+                 greatest(toDate(s.fcd), toDate(ifNull(c.onboarded_at, s.fcd))),
+                 toDate(s.lad)) < 30, 'Incubation Churn',
+        'Post D30 Churn'
+    ) AS account_status
+FROM ({client_stats}) AS s
+LEFT JOIN (
+    SELECT id, onboarded_at
+    FROM transform.Clients
+    WHERE id IN chunk_clients
+) AS c ON c.id = s.client_fk
+"""
+
+ACCOUNT_STATUS_QUERY = ACCOUNT_STATUS_TEMPLATE.format(client_stats="""
+    SELECT
+        client_fk,
+        MAX(lad) AS lad,
+        MIN(fcd) AS fcd
+    FROM transform.client_agg
+    WHERE client_fk IN chunk_clients
+    GROUP BY client_fk
+""")
+
+ACCOUNT_STATUS_FROM_STUDIES_QUERY = ACCOUNT_STATUS_TEMPLATE.format(client_stats="""
+    SELECT
+        client_fk,
+        MAX(created_at) AS lad,
+        MIN(created_at) AS fcd
+    FROM transform.Studies
+    WHERE client_fk IN chunk_clients AND status = 'COMPLETED'
+    GROUP BY client_fk
+""")
+
+def get_status_thresholds():
+    """
+    Return the (active_since, inactive_since) LAD cutoffs for a sync run.
+    """
+    today = datetime.date.today()
+    return today - timedelta(days=7), today - timedelta(days=30)
+
+def get_account_statuses(ch_client, client_fks, status_query, thresholds):
+    """
+    Return {client_fk: account_status} for every client with completed studies,
+    using status_query (ACCOUNT_STATUS_QUERY or its Studies fallback).
+    Clients missing from the result have no LAD (Still Born/Not started).
+    """
+    # NULL client_fks would fail the typed external table for the whole chunk;
+    # those rows fall back to the default status in the caller
+    client_fks = {client_fk for client_fk in client_fks if client_fk is not None}
+    if not client_fks:
+        return {}
+    # The ids travel as a native-protocol data block rather than as SQL text;
+    # only the two cutoff dates are substituted into the query client-side
+    active_since, inactive_since = thresholds
+    chunk_clients = {
+        'name': 'chunk_clients',
+        'structure': [('client_fk', 'Int64')],
+        'data': [{'client_fk': client_fk} for client_fk in client_fks],
+    }
+    results = ch_client.execute(
+        status_query,
+        {'active_since': active_since, 'inactive_since': inactive_since},
+        external_tables=[chunk_clients]
+    )
+    return dict(results)
+
+# ------------------------------
+# Chunk processing helpers
+# ------------------------------
+# Rows streamed from PostgreSQL and inserted into ClickHouse per round trip
+CHUNK_SIZE = 50_000
+# Server-side block size for inserts
+INSERT_BLOCK_SIZE = 100_000
+# Minimum seconds between progress lines while loading a table
+PROGRESS_INTERVAL = 1.0
+
+# Columns of client_group computed by the sync rather than copied from PostgreSQL
+CLIENT_GROUP_COMPUTED_COLUMNS = ('onboard_status', 'account_status')
+
+CLIENT_GROUP_QUERY = """
+    SELECT {columns},
+           CASE
+               WHEN l.existing_client IS NULL
+                   AND l.client_fk IS NOT NULL
+                   AND l.stage <> 'Onboarded'
+               THEN 'Yet To Onboard'
+               ELSE 'Onboarded'
+           END AS onboard_status
+    FROM public.client_group cg
+    LEFT JOIN public.lead l
+      ON cg.client_fk = l.client_fk
+"""
+
+def get_account_status_column(ch_client, client_fks, onboard_statuses,
+                              status_query, thresholds):
+    """
+    Return the account_status column for a chunk of client_group rows.
+    Query errors propagate: publishing every client as Still Born would be
+    worse than keeping the previous client_group.
+    """
+    # Single ClickHouse query computes LAD, first case date, onboard date
+    # and the resulting account status
+    status_dict = get_account_statuses(ch_client, client_fks, status_query, thresholds)
+    
+    # Column-wise merge: dict lookups run in C via map, and the onboarding
+    # override is a single pass over two columns
+    statuses = map(status_dict.get, client_fks, repeat("Still Born/Not started"))
+    return [
+        'Yet To Onboard' if onboard_status == 'Yet To Onboard' else status
+        for onboard_status, status in zip(onboard_statuses, statuses)
+    ]
+
+def insert_chunk(ch_client, table_name, insert_columns, convert_columns, columns):
+    """
+    Insert one chunk given as {column_name: values} into table_name.
+    Columns in convert_columns are stringified.
+    """
+    # One sequence per column, sent as-is through the driver's columnar path
+    cols = [
+        convert_column_for_ch(list(columns[col])) if col in convert_columns
+        else columns[col]
+        for col in insert_columns
+    ]
+    
+    ch_client.execute(
+        f"INSERT INTO {table_name} ({', '.join(insert_columns)}) VALUES",
+        cols,
+        columnar=True,
+        types_check=False,
+        settings={'insert_block_size': INSERT_BLOCK_SIZE}
+    )
+
+def load_chunk(ch_client, table_name, target_table, insert_columns, row_columns,
+               convert_columns, rows, status_query, thresholds):
+    """
+    Compute derived columns for a chunk and insert it into target_table.
+    Returns the number of rows loaded.
+    """
+    # The SELECT already returns only the synced columns, so the chunk is
+    # transposed in a single pass in C instead of projected per row
+    columns = dict(zip(row_columns, zip(*rows)))
+    
+    if table_name == "client_group":
+        columns['account_status'] = get_account_status_column(
+            ch_client, columns['client_fk'], columns['onboard_status'],
+            status_query, thresholds
+        )
+    
+    insert_chunk(ch_client, target_table, insert_columns, convert_columns, columns)
+    return len(rows)
+
+# ------------------------------
+# Schema helpers
+# ------------------------------
+def get_ch_columns(ch_client, table_name):
+    """
+    Return the ClickHouse column names of table_name.
+    """
+    ch_columns_info = ch_client.execute(f"DESCRIBE TABLE {table_name}")
+    return [col[0] for col in ch_columns_info]  # extract column names
+
+def get_pg_columns(pg_conn, table_name):
+    """
+    Return {column_name: type_oid} for public.table_name in table order.
+    The type OIDs tell binary COPY how to decode each column; domains are
+    resolved to their base type.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.attname,
+                   CASE WHEN t.typtype = 'd' THEN t.typbasetype ELSE a.atttypid END
+            FROM pg_attribute a
+            JOIN pg_type t ON t.oid = a.atttypid
+            WHERE a.attrelid = %s::regclass
+              AND a.attnum > 0
+              AND NOT a.attisdropped
+            ORDER BY a.attnum
+        """, (f"public.{table_name}",))
+        return dict(cur.fetchall())
+
+def get_select_list(pg_conn, pg_columns, columns, prefix=''):
+    """
+    Return (select expressions, type OIDs) for reading columns with binary COPY.
+    Types psycopg has no binary loader for (enums, citext, other extension
+    types) are cast to text in the query, so they arrive as str instead of
+    raw bytes.
+    """
+    select_exprs = []
+    select_types = []
+    for col in columns:
+        expr = f'{prefix}"{col}"'
+        type_oid = pg_columns[col]
+        if pg_conn.adapters.get_loader(type_oid, pq.Format.BINARY) is None:
+            expr = f'{expr}::text AS "{col}"'
+            type_oid = TEXT_OID
+        select_exprs.append(expr)
+        select_types.append(type_oid)
+    return select_exprs, select_types
+
+# ------------------------------
+# Optimized Sync function
+# ------------------------------
+def sync_pg_to_ch(pg_conn, ch_client, table_name):
+    print(f"[INFO] Syncing table: {table_name} from PostgreSQL → ClickHouse")
+    
+    # Step 1: Get ClickHouse table columns and select only the ones
+    # PostgreSQL also has
+    ch_columns = get_ch_columns(ch_client, table_name)
+    pg_columns = get_pg_columns(pg_conn, table_name)
+    
+    if table_name == "client_group":
+        print("[INFO] Processing client_group with enhanced account status...")
+        row_columns = [
+            col for col in ch_columns
+            if col in pg_columns and col not in CLIENT_GROUP_COMPUTED_COLUMNS
+        ]
+        if 'client_fk' not in row_columns:
+            row_columns.append('client_fk')  # needed for the status lookup
+        select_exprs, row_types = get_select_list(
+            pg_conn, pg_columns, row_columns, prefix='cg.'
+        )
+        query = CLIENT_GROUP_QUERY.format(columns=', '.join(select_exprs))
+        row_types.append(TEXT_OID)
+        row_columns.append('onboard_status')
+        # Same cutoffs for every chunk, even if the sync crosses midnight
+        thresholds = get_status_thresholds()
+        try:
+            refresh_client_aggregates(ch_client)
+            status_query = ACCOUNT_STATUS_QUERY
+            print("[INFO] Client aggregates refreshed")
+        except Exception as e:
+            # client_agg may be missing or stale; Studies is always correct
+            print(f"[ERROR] Failed to refresh client aggregates, "
+                  f"aggregating Studies directly: {e}")
+            status_query = ACCOUNT_STATUS_FROM_STUDIES_QUERY
+    else:
+        # Generic case for other tables
+        row_columns = [col for col in ch_columns if col in pg_columns]
+        select_exprs, row_types = get_select_list(pg_conn, pg_columns, row_columns)
+        query = f"SELECT {', '.join(select_exprs)} FROM public.{table_name}"
+        status_query = None
+        thresholds = None
+    
+    # Projection and conversion are decided once per table, not per chunk
+    insert_columns = [
+        col for col in ch_columns
+        if col in row_columns
+        or (table_name == "client_group" and col in CLIENT_GROUP_COMPUTED_COLUMNS)
+    ]
+    convert_columns = get_convert_columns(row_columns, row_types)
+    
+    # Step 2: Load into a staging copy so readers never see a half-empty table
+    staging_table = f"{table_name}__new"
+    ch_client.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    ch_client.execute(f"CREATE TABLE {staging_table} AS {table_name}")
+    
+    try:
+        # Step 3: Stream rows with binary COPY, one chunk at a time. Each chunk
+        # is loaded into ClickHouse on a background thread while the next one
+        # is read from PostgreSQL; at most one load is in flight, so the
+        # ClickHouse client is never used by two threads at once.
+        print(f"[INFO] Inserting data into ClickHouse staging table {staging_table}...")
+        total_rows = 0
+        next_progress_at = time.monotonic() + PROGRESS_INTERVAL
+        with ThreadPoolExecutor(max_workers=1) as loader, \
+                pg_conn.cursor() as cur, \
+                cur.copy(f"COPY ({query}) TO STDOUT (FORMAT BINARY)") as copy:
+            copy.set_types(row_types)
+            copy_rows = copy.rows()
+            pending = None
+            while True:
+                rows = list(islice(copy_rows, CHUNK_SIZE))
+                
+                if pending is not None:
+                    total_rows += pending.result()
+                    now = time.monotonic()
+                    if now >= next_progress_at:
+                        print(f"[INFO] Inserted {total_rows} rows into {staging_table}")
+                        next_progress_at = now + PROGRESS_INTERVAL
+                
+                if not rows:
+                    break
+                pending = loader.submit(
+                    load_chunk, ch_client, table_name, staging_table,
+                    insert_columns, row_columns, convert_columns, rows,
+                    status_query, thresholds
+                )
+        
+        if total_rows == 0:
+            print(f"[WARNING] No data found in PostgreSQL table {table_name}")
+            return
+        print(f"[INFO] Inserted {total_rows} rows into {staging_table}")
+        
+        # Step 4: Atomically swap the fresh data in
+        ch_client.execute(f"EXCHANGE TABLES {table_name} AND {staging_table}")
+    finally:
+        # Holds the previous data after a swap, or a partial load on failure
+        ch_client.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    
+    print(f"[SUCCESS] Table {table_name} synced successfully with complete account status!")
+
+# ------------------------------
+# Connection helpers
+# ------------------------------
+# Upper bound on tables synced concurrently (one PG + one CH connection each)
+MAX_WORKERS = 8
+
+# psycopg 3 raises DataError on 'infinity' / '-infinity' dates and timestamps,
+# which would abort the whole table. Map them to the max/min values psycopg2
+# returned instead. Binary COPY encodes them as the extreme int32 (date) and
+# int64 (timestamp) values.
+_DATE_INFINITY = struct.pack("!i", 2**31 - 1)
+_DATE_NEG_INFINITY = struct.pack("!i", -2**31)
+_TIMESTAMP_INFINITY = struct.pack("!q", 2**63 - 1)
+_TIMESTAMP_NEG_INFINITY = struct.pack("!q", -2**63)
+
+class InfDateBinaryLoader(DateBinaryLoader):
+    def load(self, data):
+        if data == _DATE_INFINITY:
+            return datetime.date.max
+        if data == _DATE_NEG_INFINITY:
+            return datetime.date.min
+        return super().load(data)
+
+class InfTimestampBinaryLoader(TimestampBinaryLoader):
+    def load(self, data):
+        if data == _TIMESTAMP_INFINITY:
+            return datetime.datetime.max
+        if data == _TIMESTAMP_NEG_INFINITY:
+            return datetime.datetime.min
+        return super().load(data)
+
+class InfTimestamptzBinaryLoader(TimestamptzBinaryLoader):
+    def load(self, data):
+        if data == _TIMESTAMP_INFINITY:
+            return datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+        if data == _TIMESTAMP_NEG_INFINITY:
+            return datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        return super().load(data)
+
+def create_pg_connection():
+    pg_conn = psycopg.connect(
+        host=PG_CONFIG['host'],
+        port=PG_CONFIG['port'],
+        dbname=PG_CONFIG['database'],
+        user=PG_CONFIG['user'],
+        password=PG_CONFIG['password']
+    )
+    pg_conn.adapters.register_loader("date", InfDateBinaryLoader)
+    pg_conn.adapters.register_loader("timestamp", InfTimestampBinaryLoader)
+    pg_conn.adapters.register_loader("timestamptz", InfTimestamptzBinaryLoader)
+    return pg_conn
+
+def create_ch_client():
+    return CHClient(
+        host=CLICKHOUSE_CONFIG['host'],
+        port=CLICKHOUSE_CONFIG['port'],
+        user=CLICKHOUSE_CONFIG['user'],
+        password=CLICKHOUSE_CONFIG['password'],
+        database=CLICKHOUSE_CONFIG['database'],
+        # Native-protocol LZ4 block compression; needs clickhouse-driver[lz4]
+        compression='lz4'
+    )
+
+def reset_pg_connection(pg_conn):
+    """
+    End the read transaction so pg_conn can be reused. A broken connection is
+    replaced with a new one; if reconnecting fails too, the closed connection
+    is returned so the next user fails fast instead of the pool shrinking.
+    Never raises, so it cannot mask the sync's own error.
+    """
+    try:
+        pg_conn.rollback()
+        return pg_conn
+    except Exception as e:
+        print(f"[WARNING] Replacing broken PostgreSQL connection: {e}")
+        pg_conn.close()
+    try:
+        return create_pg_connection()
+    except Exception as e:
+        print(f"[ERROR] Failed to reconnect to PostgreSQL: {e}")
+        return pg_conn
+
+def sync_table(pg_pool, ch_pool, table_name):
+    """
+    Sync one table using connections borrowed from the shared pools.
+    """
+    pg_conn = pg_pool.get()
+    ch_client = ch_pool.get()
+    try:
+        sync_pg_to_ch(pg_conn, ch_client, table_name)
+    finally:
+        ch_pool.put(ch_client)
+        pg_pool.put(reset_pg_connection(pg_conn))